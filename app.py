@@ -1,10 +1,10 @@
+# Heavy modules (plotly, openai, PIL, diskcache) are imported at their use
+# sites below, so the header and sidebar paint before they load.
 import streamlit as st
+import numpy as np
 import pandas as pd
-import openai
-import plotly.express as px
-import tiktoken
 import json
-from PIL import Image
+import hashlib
 import os
 
 # --- Page Config ---
@@ -15,7 +15,11 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 logo_path = os.path.join(current_dir, "static", "images", "logo.png")
 
 # --- Custom CSS ---
-st.markdown("""
+# Collapsed to a single line once at import so each rerun ships the minimal
+# payload. (The block must still be emitted per rerun: Streamlit drops
+# elements that a rerun does not re-render, so a session_state guard would
+# lose the styling after the first interaction.)
+CSS = " ".join("""
 <style>
     [data-testid="stSidebar"] {
         background-color: #070969;
@@ -37,45 +41,119 @@ st.markdown("""
         color: white;
     }
 </style>
-""", unsafe_allow_html=True)
+""".split())
+
+st.markdown(CSS, unsafe_allow_html=True)
 
 # --- Header with Logo ---
+@st.cache_resource(show_spinner=False)
+def get_logo(path):
+    # decode the PNG once per process instead of on every rerun
+    from PIL import Image
+    return Image.open(path)
+
 try:
     if os.path.exists(logo_path):
-        logo = Image.open(logo_path)
-        st.image(logo, width=300)
+        st.image(get_logo(logo_path), width=300)
     else:
         st.error(f"Logo not found at: {logo_path}")
 except Exception as e:
     st.error(f"Error loading logo: {str(e)}")
 
 # --- Load Data ---
+@st.cache_data(show_spinner=False)
+def load_leads(path, mtime):
+    # mtime is part of the cache key so an updated CSV invalidates the entry
+    df = pd.read_csv(path, parse_dates=["Created Date", "Appointment Date"])
+    # Low-cardinality string columns become categoricals: smaller in memory,
+    # and unique()/value_counts()/isin() run on integer codes instead of
+    # hashing Python strings row by row.
+    for col in ["Status", "Country", "Assigned To", "Procedure Name",
+                "Doctor Assigned", "Nationality", "Ref Company"]:
+        df[col] = df[col].astype("category")
+    return df
+
 try:
-    df = pd.read_csv("synthetic_leads_data.csv")
+    data_path = os.path.join(current_dir, "synthetic_leads_data.csv")
+    df = load_leads(data_path, os.path.getmtime(data_path))
 except Exception as e:
     st.error(f"Error loading data: {str(e)}")
     st.stop()
 
 # --- Filters ---
+# The option lists are static properties of the loaded CSV; with categorical
+# columns they are just the category levels (already sorted, NaN excluded).
+@st.cache_data(show_spinner=False)
+def filter_options(path, mtime):
+    df = load_leads(path, mtime)
+    return {
+        "status": df["Status"].cat.categories.tolist(),
+        "country": df["Country"].cat.categories.tolist(),
+        "agent": df["Assigned To"].cat.categories.tolist(),
+    }
+
+options = filter_options(data_path, os.path.getmtime(data_path))
+
 st.sidebar.header("Filter Options")
-status_filter = st.sidebar.multiselect("Filter by Status", options=df["Status"].unique())
-country_filter = st.sidebar.multiselect("Filter by Country", options=df["Country"].dropna().unique())
-agent_filter = st.sidebar.multiselect("Filter by Agent", options=df["Assigned To"].dropna().unique())
-
-# Apply filters
-filtered_df = df.copy()
-if status_filter:
-    filtered_df = filtered_df[filtered_df["Status"].isin(status_filter)]
-if country_filter:
-    filtered_df = filtered_df[filtered_df["Country"].isin(country_filter)]
-if agent_filter:
-    filtered_df = filtered_df[filtered_df["Assigned To"].isin(agent_filter)]
+status_filter = st.sidebar.multiselect("Filter by Status", options=options["status"])
+country_filter = st.sidebar.multiselect("Filter by Country", options=options["country"])
+agent_filter = st.sidebar.multiselect("Filter by Agent", options=options["agent"])
+
+def cat_mask(series, values):
+    # Map the selected values to category codes once, then compare integer
+    # codes with np.isin instead of hashing a string per row.
+    codes = series.cat.categories.get_indexer(values)
+    return np.isin(series.cat.codes.to_numpy(), codes)
+
+# Apply filters: build one fused boolean mask and index once, instead of
+# copying the frame and re-slicing it per filter. Cached on the filter
+# tuples only, so reruns triggered by unrelated widgets (e.g. the question
+# box) reuse the previous result without hashing the DataFrame.
+@st.cache_data(show_spinner=False)
+def filter_leads(status, country, agent):
+    df = load_leads(data_path, os.path.getmtime(data_path))
+    mask = np.ones(len(df), dtype=bool)
+    if status:
+        mask &= cat_mask(df["Status"], status)
+    if country:
+        mask &= cat_mask(df["Country"], country)
+    if agent:
+        mask &= cat_mask(df["Assigned To"], agent)
+    return df.loc[mask]
+
+# One pass over the filtered frame produces every per-column count the
+# charts need; cached on the same key as filter_leads.
+@st.cache_data(show_spinner=False)
+def lead_counts(status, country, agent):
+    df = filter_leads(status, country, agent)
+    counts = {}
+    for col in ("Status", "Country", "Procedure Name", "Assigned To", "Doctor Assigned"):
+        col_counts = df[col].value_counts()
+        counts[col] = col_counts[col_counts > 0]  # drop empty categorical levels
+    return counts
+
+filter_key = (tuple(status_filter), tuple(country_filter), tuple(agent_filter))
+filtered_df = filter_leads(*filter_key)
+counts = lead_counts(*filter_key)
 
 # --- Data Preview ---
+# Serializing the full frame over the websocket dominates UI latency, so
+# cap the preview and offer the complete data as a download instead.
+@st.cache_data(show_spinner=False)
+def full_csv(status, country, agent):
+    return filter_leads(status, country, agent).to_csv(index=False).encode()
+
+PREVIEW_ROWS = 500
+
 st.subheader("🔍 Data Preview")
-st.dataframe(filtered_df, use_container_width=True)
+st.dataframe(filtered_df.head(PREVIEW_ROWS), use_container_width=True)
+if len(filtered_df) > PREVIEW_ROWS:
+    st.caption(f"Showing {PREVIEW_ROWS} of {len(filtered_df)} rows")
+st.download_button("Download full CSV", full_csv(*filter_key), "leads.csv")
 
 # --- Key Insights Charts ---
+import plotly.express as px
+
 st.subheader("📊 Key Insights")
 
 # Create two columns for the charts
@@ -83,7 +161,7 @@ left_col, right_col = st.columns(2)
 
 with left_col:
     # Chart 1: Lead Status Distribution
-    status_counts = filtered_df["Status"].value_counts()
+    status_counts = counts["Status"]
     fig1 = px.pie(
         values=status_counts.values,
         names=status_counts.index,
@@ -92,7 +170,7 @@ with left_col:
     st.plotly_chart(fig1, use_container_width=True)
     
     # Chart 2: Top Countries by Lead Count
-    country_counts = filtered_df["Country"].value_counts().head(10)
+    country_counts = counts["Country"].head(10)
     fig2 = px.bar(
         x=country_counts.index,
         y=country_counts.values,
@@ -103,7 +181,7 @@ with left_col:
 
 with right_col:
     # Chart 3: Treatment Type Distribution
-    treatment_counts = filtered_df["Procedure Name"].value_counts()
+    treatment_counts = counts["Procedure Name"]
     fig3 = px.pie(
         values=treatment_counts.values,
         names=treatment_counts.index,
@@ -112,7 +190,7 @@ with right_col:
     st.plotly_chart(fig3, use_container_width=True)
     
     # Chart 4: Assigned Doctor Distribution
-    doctor_counts = filtered_df["Doctor Assigned"].value_counts().head(10)
+    doctor_counts = counts["Doctor Assigned"].head(10)
     fig4 = px.bar(
         x=doctor_counts.index,
         y=doctor_counts.values,
@@ -127,11 +205,12 @@ MODEL_NAME = "gpt-4"
 MAX_TOKENS = 5000
 
 def trim_messages(messages, max_tokens=MAX_TOKENS):
-    encoding = tiktoken.encoding_for_model(MODEL_NAME)
     total_tokens = 0
     trimmed = []
     for message in reversed(messages):
-        message_tokens = sum(len(encoding.encode(v)) for v in message.values())
+        # ~4 chars per token is close enough for a keep/drop decision and
+        # avoids a full BPE encode of the prompt on every call.
+        message_tokens = sum(len(v) for v in message.values()) // 4
         if total_tokens + message_tokens > max_tokens:
             break
         trimmed.insert(0, message)
@@ -173,54 +252,173 @@ chart_tool = {
 }
 
 # --- Ask a Question Section ---
+@st.cache_resource(show_spinner=False)
+def get_openai():
+    # One client per process: keeps the httpx connection pool (TLS + HTTP/2
+    # keep-alive) alive across reruns instead of rebuilding it per request.
+    import openai
+    import httpx
+    return openai.OpenAI(
+        api_key=st.secrets["OPENAI_API_KEY"],
+        http_client=httpx.Client(http2=True),
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_llm_cache():
+    # Disk-backed so answers survive page reloads, server restarts and are
+    # shared across workers; diskcache is thread- and process-safe.
+    import diskcache
+    return diskcache.Cache(os.path.join(current_dir, ".llm_cache"))
+
+LLM_CACHE_TTL = 7 * 86400  # seconds
+
 if not filtered_df.empty:
     try:
         # --- Ask a Question or Request a Chart ---
-        client = openai.OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-        csv_data = filtered_df.head(50).to_csv(index=False)
+        client = get_openai()
+
+        # Send pre-aggregated counts rather than raw rows: almost every
+        # question is answerable from group-by tables, at a fraction of the
+        # input tokens of a 50-row CSV dump. Cached on the filter key so the
+        # JSON is only rebuilt when the filtered view actually changes, not
+        # on every keystroke in the question box.
+        @st.cache_data(show_spinner=False)
+        def summarize_leads(status, country, agent):
+            df = filter_leads(status, country, agent)
+
+            def count_dict(series, top=None):
+                counts = series.value_counts()
+                counts = counts[counts > 0]  # drop empty categorical levels
+                if top:
+                    counts = counts.head(top)
+                return {str(name): int(n) for name, n in counts.items()}
+
+            summary = {
+                "total_leads": len(df),
+                "date_range": [
+                    str(df["Created Date"].min().date()),
+                    str(df["Created Date"].max().date()),
+                ],
+                "by_status": count_dict(df["Status"]),
+                "by_country": count_dict(df["Country"], top=15),
+                "by_procedure": count_dict(df["Procedure Name"]),
+                "by_agent": count_dict(df["Assigned To"]),
+                "by_doctor": count_dict(df["Doctor Assigned"], top=10),
+            }
+            return json.dumps(summary)
+
+        dataset_summary = summarize_leads(*filter_key)
 
         st.subheader("💬 Ask a Question or Request a Chart")
         user_question = st.text_input("Ask something like: 'Show a pie chart of leads by status in Qatar'")
 
         if user_question:
             with st.spinner("Thinking..."):
-                messages = [
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": f"Here is the dataset:\n{csv_data}\n\nQuestion: {user_question}"}
-                ]
-                trimmed_messages = trim_messages(messages)
-
-                response = client.chat.completions.create(
-                    model=MODEL_NAME,
-                    messages=trimmed_messages,
-                    tools=[chart_tool],
-                    tool_choice="auto"
-                )
-
-                choice = response.choices[0]
-
-                # If GPT used the tool (chart request)
-                if hasattr(choice.message, "tool_calls") and choice.message.tool_calls:
-                    tool_call = choice.message.tool_calls[0]
-                    chart_config = json.loads(tool_call.function.arguments)
-                    
-                    # Generate and display the requested chart
-                    if chart_config["type"] == "pie":
-                        fig = px.pie(
-                            filtered_df,
-                            names=chart_config["x"],
-                            title=chart_config["title"]
-                        )
-                    else:  # bar chart
-                        fig = px.bar(
-                            filtered_df,
-                            x=chart_config["x"],
-                            y=chart_config.get("y"),
-                            title=chart_config["title"]
+                # --- Semantic cache: skip the GPT-4 round-trip for questions
+                # we have already answered on the same filtered view ---
+                llm_cache = get_llm_cache()
+                filter_signature = json.dumps([status_filter, country_filter, agent_filter])
+                norm_question = user_question.lower().strip()
+                cache_key = hashlib.sha256((filter_signature + norm_question).encode()).hexdigest()
+
+                cached = llm_cache.get(cache_key)
+                question_embedding = None
+                if cached is None:
+                    # No exact hit: embed the question and accept a stored
+                    # answer to a near-duplicate question (cosine > 0.95).
+                    emb = client.embeddings.create(model="text-embedding-3-small", input=norm_question)
+                    question_embedding = np.array(emb.data[0].embedding)
+                    for key in llm_cache:
+                        entry = llm_cache.get(key)
+                        if entry is None or entry["signature"] != filter_signature:
+                            continue
+                        other = entry["embedding"]
+                        cosine = np.dot(question_embedding, other) / (
+                            np.linalg.norm(question_embedding) * np.linalg.norm(other)
                         )
-                    st.plotly_chart(fig, use_container_width=True)
+                        if cosine > 0.95:
+                            cached = entry
+                            break
+
+                if cached is not None:
+                    st.write(cached["answer"])
                 else:
-                    # Display the text response
-                    st.write(choice.message.content)
+                    # Keep the large static block (prompt + dataset) as a stable
+                    # prefix and the volatile question last, so provider-side
+                    # prompt caching can reuse the prefix across questions.
+                    messages = [
+                        {"role": "system", "content": f"{SYSTEM_PROMPT}\n\nDATASET SUMMARY (JSON):\n{dataset_summary}"},
+                        {"role": "user", "content": user_question}
+                    ]
+                    trimmed_messages = trim_messages(messages)
+
+                    # Stream the completion so text answers render token by
+                    # token instead of blocking on the full generation. Tool
+                    # calls arrive as argument fragments, collected as we go.
+                    stream = client.chat.completions.create(
+                        model=MODEL_NAME,
+                        messages=trimmed_messages,
+                        tools=[chart_tool],
+                        tool_choice="auto",
+                        stream=True
+                    )
+
+                    tool_args = []
+
+                    def stream_text():
+                        for chunk in stream:
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta
+                            if delta.tool_calls:
+                                for tc in delta.tool_calls:
+                                    if tc.function.arguments:
+                                        tool_args.append(tc.function.arguments)
+                            elif delta.content:
+                                yield delta.content
+
+                    answer = st.write_stream(stream_text())
+
+                    # If GPT used the tool (chart request)
+                    if tool_args:
+                        chart_config = json.loads("".join(tool_args))
+
+                        # Generate and display the requested chart. Aggregate
+                        # here so Plotly is handed O(#categories) values, not
+                        # every row of the filtered frame.
+                        chart_counts = filtered_df[chart_config["x"]].value_counts()
+                        chart_counts = chart_counts[chart_counts > 0]
+                        if chart_config["type"] == "pie":
+                            fig = px.pie(
+                                values=chart_counts.values,
+                                names=chart_counts.index,
+                                title=chart_config["title"]
+                            )
+                        elif chart_config.get("y"):  # bar with an explicit y column
+                            fig = px.bar(
+                                filtered_df,
+                                x=chart_config["x"],
+                                y=chart_config["y"],
+                                title=chart_config["title"]
+                            )
+                        else:  # bar of counts per category
+                            fig = px.bar(
+                                x=chart_counts.index,
+                                y=chart_counts.values,
+                                title=chart_config["title"],
+                                labels={"x": chart_config["x"], "y": "Count"}
+                            )
+                        st.plotly_chart(fig, use_container_width=True)
+                    else:
+                        # Text response was already streamed; remember it for repeats
+                        llm_cache.set(
+                            cache_key,
+                            {
+                                "answer": answer,
+                                "embedding": question_embedding,
+                                "signature": filter_signature,
+                            },
+                            expire=LLM_CACHE_TTL,
+                        )
     except Exception as e:
         st.error(f"Error processing question: {str(e)}")